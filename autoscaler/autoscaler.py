@@ -1,21 +1,107 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 import time
+import math
 import os
+import sys
 import json
 import argparse
 import random
 import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-last_deploy_time = None
-last_destroy_time = None
-last_notification_time = None
-last_token_refresh_time = None
-current_access_token = None
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
 
 load_dotenv()
 
+if os.name == 'nt':
+    # Run once so the classic Windows console interprets the ANSI escapes used by clear_screen()
+    os.system('')
+
+RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504), respect_retry_after_header=True)
+
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=RETRY)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+POLL_INTERVAL = 10
+METRIC_WORKERS = 16
+PUSHOVER_WORKERS = 4
+BATCH_URL = "https://management.azure.com/batch?api-version=2020-06-01"
+BATCH_SIZE = 20
+
+@dataclass
+class CooldownTracker:
+    deploy: float = -math.inf
+    destroy: float = -math.inf
+    notify: float = -math.inf
+    token: Optional[str] = None
+    token_expiry: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    token_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def remaining(self, action, cooldown):
+        with self.lock:
+            return max(0.0, cooldown - (time.monotonic() - getattr(self, action)))
+
+    def claim(self, action, cooldown):
+        with self.lock:
+            current_mono = time.monotonic()
+            remaining = cooldown - (current_mono - getattr(self, action))
+            if remaining > 0:
+                return remaining
+            setattr(self, action, current_mono)
+            return 0.0
+
+    def mark(self, action, when):
+        with self.lock:
+            setattr(self, action, when)
+
+class AzureAuthAdapter(HTTPAdapter):
+    def __init__(self, config, tracker, **kwargs):
+        # HTTPAdapter.__init__ resets self.config, so the Azure config lives under its own name
+        self.azure_config = config
+        self.tracker = tracker
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        used_token = get_azure_token(self.azure_config, self.tracker)
+        if not used_token:
+            raise requests.ConnectionError("Geen Azure token beschikbaar", request=request)
+        request.headers["Authorization"] = f"Bearer {used_token}"
+        response = super().send(request, **kwargs)
+        if response.status_code != 401:
+            return response
+
+        with self.tracker.token_lock:
+            if self.tracker.token == used_token:
+                print("Token verlopen, nieuwe token ophalen...")
+                self.tracker.token = None
+        access_token = get_azure_token(self.azure_config, self.tracker)
+        if not access_token:
+            return response
+
+        response.close()
+        request.headers["Authorization"] = f"Bearer {access_token}"
+        return super().send(request, **kwargs)
+
 def load_config():
     config = {
         'azure': {
@@ -58,6 +144,9 @@ def load_config():
     return config
 
 def setup_logging():
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
     logging.basicConfig(
         filename='container_actions.log',
         level=logging.INFO,
@@ -66,49 +155,63 @@ def setup_logging():
     )
 
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if sys.stdout.isatty():
+        sys.stdout.write("\x1b[2J\x1b[H")
+        sys.stdout.flush()
+
+def wait_for_next_tick(tick_start):
+    time.sleep(max(0, POLL_INTERVAL - (time.monotonic() - tick_start)))
 
 def format_bytes(bytes_value):
     if bytes_value >= 1024:
         return f"{bytes_value/1024:.1f} KB/s"
     return f"{bytes_value:.1f} B/s"
 
-def send_pushover_notification(config, title, message, priority=0):
-    global last_notification_time
+def send_pushover_message(config, pushover_config, title, message, priority):
+    payload = {
+        "token": pushover_config["token"],
+        "user": pushover_config["user_key"],
+        "title": title,
+        "message": message,
+        "priority": priority
+    }
     
-    current_time = datetime.utcnow()
-    if last_notification_time and (current_time - last_notification_time).total_seconds() < config['thresholds']['notification_cooldown']:
+    response = SESSION.post(config['pushover']['api_url'], json=payload, timeout=5)
+    response.raise_for_status()
+    print(f"📱 Notificatie verzonden naar {pushover_config['user_key']}: {title}")
+
+def send_pushover_notification(config, tracker, title, message, priority=0):
+    current_mono = time.monotonic()
+    if tracker.remaining("notify", config['thresholds']['notification_cooldown']) > 0:
         return
         
     try:
-        for pushover_config in config['pushover']['configs']:
-            payload = {
-                "token": pushover_config["token"],
-                "user": pushover_config["user_key"],
-                "title": title,
-                "message": message,
-                "priority": priority
-            }
-            
-            response = requests.post(config['pushover']['api_url'], json=payload)
-            response.raise_for_status()
-            print(f"📱 Notificatie verzonden naar {pushover_config['user_key']}: {title}")
+        with ThreadPoolExecutor(max_workers=PUSHOVER_WORKERS) as executor:
+            list(executor.map(
+                lambda pushover_config: send_pushover_message(config, pushover_config, title, message, priority),
+                config['pushover']['configs']
+            ))
         
-        last_notification_time = current_time
+        tracker.mark("notify", current_mono)
     except Exception as e:
         print(f"Fout bij verzenden notificatie: {e}")
 
-def get_azure_token(config):
-    global last_token_refresh_time, current_access_token
-    
-    current_time = datetime.utcnow()
-    
-    if (current_access_token and last_token_refresh_time and 
-        (current_time - last_token_refresh_time).total_seconds() < 3600):
-        return current_access_token
+def get_azure_token(config, tracker):
+    token = tracker.token
+    if token and time.monotonic() < tracker.token_expiry:
+        return token
+        
+    with tracker.token_lock:
+        current_mono = time.monotonic()
         
+        if tracker.token and current_mono < tracker.token_expiry:
+            return tracker.token
+            
+        return refresh_azure_token(config, tracker, current_mono)
+
+def refresh_azure_token(config, tracker, current_mono):
     try:
-        response = requests.post(
+        response = SESSION.post(
             f"https://login.microsoftonline.com/{config['azure']['tenant_id']}/oauth2/token",
             headers={"Content-Type": "application/x-www-form-urlencoded"},
             data={
@@ -116,39 +219,38 @@ def get_azure_token(config):
                 "client_id": config['azure']['client_id'],
                 "client_secret": config['azure']['client_secret'],
                 "resource": "https://management.azure.com/"
-            }
+            },
+            timeout=10
         )
         response.raise_for_status()
         token_data = response.json()
-        current_access_token = token_data.get("access_token")
-        last_token_refresh_time = current_time
-        print(f"Azure token vernieuwd op {current_time.strftime('%H:%M:%S')}")
-        return current_access_token
+        tracker.token = token_data.get("access_token")
+        tracker.token_expiry = current_mono + int(token_data.get("expires_in", 3600)) - 300
+        print(f"Azure token vernieuwd op {datetime.now().strftime('%H:%M:%S')}")
+        return tracker.token
     except Exception as e:
         print(f"Fout bij ophalen Azure token: {e}")
         return None
 
-def send_github_workflow_dispatch(config, container_name, metric_value, is_destroy=False, total_containers=0, monitor_only=False):
-    global last_deploy_time, last_destroy_time
+def send_github_workflow_dispatch(config, tracker, container_name, metric_value, is_destroy=False, total_containers=0, monitor_only=False):
     action = "deploy" if not is_destroy else "destroy"  
     
     if monitor_only:
         print(f"Monitor mode: Zou {'destroy' if is_destroy else 'deploy'} container {container_name}")
-        logging.info(f"Monitor mode: Zou {'destroy' if is_destroy else 'deploy'} container {container_name}")
+        logging.info("Monitor mode: Zou %s container %s", action, container_name)
         return
         
     try:
         if is_destroy:
             if total_containers <= 1:
                 print(f"Skipping destroy van {container_name}")
-                logging.info(f"Skipping destroy van {container_name}")
+                logging.info("Skipping destroy van %s", container_name)
                 return
                 
-            current_time = datetime.utcnow()
-            if last_destroy_time and (current_time - last_destroy_time).total_seconds() < config['thresholds']['destroy_cooldown']:
-                remaining = config['thresholds']['destroy_cooldown'] - (current_time - last_destroy_time).total_seconds()
+            remaining = tracker.claim("destroy", config['thresholds']['destroy_cooldown'])
+            if remaining > 0:
                 print(f"Skipping destroy - cooldown periode actief ({remaining:.0f} seconden resterend)")
-                logging.info(f"Skipping destroy - cooldown period actief ({remaining:.0f} seconden resterend)")
+                logging.info("Skipping destroy - cooldown period actief (%.0f seconden resterend)", remaining)
                 return
                 
             payload = {
@@ -158,44 +260,43 @@ def send_github_workflow_dispatch(config, container_name, metric_value, is_destr
                 }
             }
             url = config['github']['destroy_url']
-            last_destroy_time = current_time
             
-            logging.info(f"Container {container_name} wordt verwijderd vanwege lage netwerk activiteit ({format_bytes(metric_value)})")
-            logging.info(f"Totale containers over: {total_containers - 1}")
+            logging.info("Container %s wordt verwijderd vanwege lage netwerk activiteit (%s)", container_name, format_bytes(metric_value))
+            logging.info("Totale containers over: %d", total_containers - 1)
             
             send_pushover_notification(
                 config,
+                tracker,
                 "Container Verwijderd",
                 f"Container {container_name} wordt verwijderd vanwege lage netwerk activiteit ({format_bytes(metric_value)}).\n"
                 f"Totale containers over: {total_containers - 1}",
                 priority=1
             )
         else:
-            current_time = datetime.utcnow()
-            if last_deploy_time and (current_time - last_deploy_time).total_seconds() < config['thresholds']['deploy_cooldown']:
-                remaining = config['thresholds']['deploy_cooldown'] - (current_time - last_deploy_time).total_seconds()
+            remaining = tracker.claim("deploy", config['thresholds']['deploy_cooldown'])
+            if remaining > 0:
                 print(f"Skipping deploy - cooldown periode actief ({remaining:.0f} seconden resterend)")
-                logging.info(f"Skipping deploy - cooldown periode actief ({remaining:.0f} seconden resterend)")
+                logging.info("Skipping deploy - cooldown periode actief (%.0f seconden resterend)", remaining)
                 return
             
             payload = {
                 "ref": "master"
             }
             url = config['github']['api_url']
-            last_deploy_time = current_time
             
-            logging.info(f"Nieuwe container wordt aangemaakt vanwege hoge netwerk activiteit ({format_bytes(metric_value)})")
-            logging.info(f"Totale containers na aanmaken: {total_containers + 1}")
+            logging.info("Nieuwe container wordt aangemaakt vanwege hoge netwerk activiteit (%s)", format_bytes(metric_value))
+            logging.info("Totale containers na aanmaken: %d", total_containers + 1)
             
             send_pushover_notification(
                 config,
+                tracker,
                 "Container Aangemaakt",
                 f"Nieuwe container wordt aangemaakt vanwege hoge netwerk activiteit:\n"
                 f"Netwerk activiteit: {format_bytes(metric_value)}",
                 priority=1
             )
         
-        response = requests.post(
+        response = SESSION.post(
             url,
             headers={
                 "Accept": "application/vnd.github+json",
@@ -206,85 +307,180 @@ def send_github_workflow_dispatch(config, container_name, metric_value, is_destr
         )
         response.raise_for_status()
         print(f"GitHub {action} workflow triggered voor {container_name} (Network traffic: {format_bytes(metric_value)})")
-        logging.info(f"GitHub {action} workflow triggered voor {container_name} (Network traffic: {format_bytes(metric_value)})")
+        logging.info("GitHub %s workflow triggered voor %s (Network traffic: %s)", action, container_name, format_bytes(metric_value))
     except Exception as e:
         error_msg = f"Error triggering GitHub {action} workflow: {e}"
         print(error_msg)
         logging.error(error_msg)
         send_pushover_notification(
             config,
+            tracker,
             f"Container {action.capitalize()} Failed",
             f"Failed to {action} container {container_name}: {str(e)}",
             priority=2
         )
 
-def send_to_elasticsearch(config, container_data, network_stats):
-    try:
-        doc = {
-            "@timestamp": datetime.utcnow().isoformat() + "Z",
-            "data_stream": {
-                "dataset": "azure.container_instance"
-            },
-            "azure": {
-                "container_instance": {
-                    "network_bytes_received_per_second": {
-                        "avg": network_stats.get("bytes_received", 0)
-                    },
-                    "network_bytes_transmitted_per_second": {
-                        "avg": network_stats.get("bytes_transmitted", 0)
-                    },
-                    "cpu_usage": {
-                        "avg": network_stats.get("cpu_usage", 0)
-                    }
+def build_container_doc(container_data, network_stats, timestamp):
+    return {
+        "@timestamp": timestamp,
+        "data_stream": {
+            "dataset": "azure.container_instance"
+        },
+        "azure": {
+            "container_instance": {
+                "network_bytes_received_per_second": {
+                    "avg": network_stats.get("bytes_received", 0)
+                },
+                "network_bytes_transmitted_per_second": {
+                    "avg": network_stats.get("bytes_transmitted", 0)
                 },
-                "resource": {
-                    "name": container_data.get("name", "Unknown"),
-                    "id": container_data.get("id", "Unknown")
+                "cpu_usage": {
+                    "avg": network_stats.get("cpu_usage", 0)
                 }
             },
-            "host": {
-                "hostname": container_data.get("properties", {}).get("containers", [{}])[0].get("name", "Unknown")
-            },
-            "cloud": {
-                "region": container_data.get("location", "Unknown")
+            "resource": {
+                "name": container_data.get("name", "Unknown"),
+                "id": container_data.get("id", "Unknown")
+            }
+        },
+        "host": {
+            "hostname": container_data.get("properties", {}).get("containers", [{}])[0].get("name", "Unknown")
+        },
+        "cloud": {
+            "region": container_data.get("location", "Unknown")
+        }
+    }
+
+def build_container_count_doc(total_containers, timestamp):
+    return {
+        "@timestamp": timestamp,
+        "data_stream": {
+            "dataset": "azure.container_count"
+        },
+        "azure": {
+            "container_count": {
+                "total": total_containers
             }
         }
+    }
+
+def send_bulk_to_elasticsearch(config, docs):
+    try:
+        body = b"".join(
+            json_dumps({"create": {"_index": index}}) + b"\n" + json_dumps(doc) + b"\n"
+            for index, doc in docs
+        )
 
-        response = requests.post(
-            f"{config['elasticsearch']['url']}/metrics-azure.container_instance/_doc",
+        response = SESSION.post(
+            f"{config['elasticsearch']['url']}/_bulk",
             auth=(config['elasticsearch']['user'], config['elasticsearch']['password']),
-            json=doc,
+            headers={"Content-Type": "application/x-ndjson"},
+            data=body,
             timeout=5
         )
         response.raise_for_status()
-        print(f"Metrics verzonden naar Elasticsearch voor {container_data.get('name')}")
+        if response.json().get("errors"):
+            print("Elasticsearch bulk request bevatte fouten voor een of meer documenten")
+        else:
+            print(f"{len(docs)} documenten verzonden naar Elasticsearch")
     except Exception as e:
         print(f"Fout bij verzenden naar Elasticsearch: {e}")
 
-def send_container_count_to_elasticsearch(config, total_containers):
+def iter_container_groups(first_page):
+    page = first_page
+    while True:
+        yield from page.get("value", [])
+        next_link = page.get("nextLink")
+        if not next_link:
+            return
+        r = SESSION.get(next_link, timeout=10)
+        r.raise_for_status()
+        page = r.json()
+
+def build_metric_paths(containers):
+    return {c["id"]: f"{c['id']}/providers/microsoft.insights/metrics" for c in containers}
+
+def get_container_metrics(container, metric_path, params):
+    metric_url = f"https://management.azure.com{metric_path}"
     try:
-        doc = {
-            "@timestamp": datetime.utcnow().isoformat() + "Z",
-            "data_stream": {
-                "dataset": "azure.container_count"
-            },
-            "azure": {
-                "container_count": {
-                    "total": total_containers
+        r = SESSION.get(metric_url, params=params, timeout=10)
+        return json_loads(r.content)
+    except Exception as e:
+        print(f"Fout bij ophalen metrics voor {container.get('name')}: {e}")
+        return {}
+
+def get_container_metrics_batch(containers, metric_paths, params):
+    # {} means no data this tick, None means retry that container with a single GET
+    query = urlencode(params)
+    results = [{} for _ in containers]
+
+    for offset in range(0, len(containers), BATCH_SIZE):
+        chunk = containers[offset:offset + BATCH_SIZE]
+        body = {
+            "requests": [
+                {
+                    "httpMethod": "GET",
+                    "url": f"{metric_paths[container['id']]}?{query}",
+                    "name": str(offset + i)
                 }
-            }
+                for i, container in enumerate(chunk)
+            ]
         }
+        try:
+            r = SESSION.post(BATCH_URL, json=body, timeout=10)
+        except Exception as e:
+            print(f"Batch request mislukt: {e}")
+            continue
 
-        response = requests.post(
-            f"{config['elasticsearch']['url']}/metrics-azure.container_count/_doc",
-            auth=(config['elasticsearch']['user'], config['elasticsearch']['password']),
-            json=doc,
-            timeout=5
-        )
-        response.raise_for_status()
-        print(f"Container count ({total_containers}) verzonden naar Elasticsearch")
-    except Exception as e:
-        print(f"Fout bij verzenden container count naar Elasticsearch: {e}")
+        if r.status_code == 429 or r.status_code >= 500:
+            print(f"Batch request afgewezen ({r.status_code}, Retry-After: {r.headers.get('Retry-After', '-')}), metrics overgeslagen deze tick")
+            break
+        if r.status_code != 200:
+            print(f"Batch request mislukt: onverwachte status {r.status_code}")
+            continue
+
+        try:
+            for response in json_loads(r.content).get("responses", []):
+                status = response.get("httpStatusCode")
+                if status == 200:
+                    results[int(response["name"])] = response.get("content", {})
+                elif status != 429:
+                    results[int(response["name"])] = None
+        except Exception as e:
+            print(f"Fout bij verwerken batch response: {e}")
+
+    return results
+
+def fetch_all_container_metrics(containers, metric_paths, params):
+    results = get_container_metrics_batch(containers, metric_paths, params)
+
+    missing = [i for i, data in enumerate(results) if data is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=METRIC_WORKERS) as executor:
+            fetched = executor.map(
+                lambda i: get_container_metrics(containers[i], metric_paths[containers[i]["id"]], params),
+                missing
+            )
+            for i, data in zip(missing, fetched):
+                results[i] = data
+
+    return list(zip(containers, results))
+
+def average_metrics(rx, tx, cpu):
+    if len(rx) == len(tx) == len(cpu):
+        sum_rx = sum_tx = sum_cpu = 0.0
+        for r, t, c in zip(rx, tx, cpu):
+            sum_rx += r.get("average", 0)
+            sum_tx += t.get("average", 0)
+            sum_cpu += c.get("average", 0)
+        n = len(rx)
+        return sum_rx / n, sum_tx / n, sum_cpu / n
+
+    return (
+        math.fsum(p.get("average", 0) for p in rx) / len(rx),
+        math.fsum(p.get("average", 0) for p in tx) / len(tx),
+        math.fsum(p.get("average", 0) for p in cpu) / len(cpu)
+    )
 
 def generate_fake_container_data(config):
     containers = []
@@ -325,6 +521,7 @@ def generate_fake_metrics():
 
 def main():
     config = load_config()
+    tracker = CooldownTracker()
     
     setup_logging()
     
@@ -339,18 +536,31 @@ def main():
     if args.debug:
         logging.info("Debug mode actief - Gebruik nep data")
     
-    access_token = get_azure_token(config)
+    access_token = get_azure_token(config, tracker)
     if not access_token:
         error_msg = "Kon geen Azure token ophalen. Script stopt."
         print(f"{error_msg}")
         logging.error(error_msg)
         return
         
-    headers = {
-        "Authorization": f"Bearer {access_token}"
+    SESSION.mount("https://management.azure.com/", AzureAuthAdapter(config, tracker, pool_connections=8, pool_maxsize=32, max_retries=RETRY))
+    
+    background = ThreadPoolExecutor(max_workers=2)
+    container_data = None
+    container_etag = None
+    container_url = f"https://management.azure.com/subscriptions/{config['azure']['subscription_id']}/providers/Microsoft.ContainerInstance/containerGroups?api-version=2023-05-01"
+    metric_paths = {}
+    metric_params = {
+        "api-version": "2018-01-01",
+        "metricnames": "NetworkBytesReceivedPerSecond,NetworkBytesTransmittedPerSecond,CpuUsage",
+        "interval": "PT1M",
+        "timespan": None
     }
     
     while True:
+        tick_start = time.monotonic()
+        now = datetime.utcnow()
+        now_iso = now.isoformat(timespec="seconds") + "Z"
         clear_screen()
         print("\n" + "="*50)
         print(f"Update op {datetime.now().strftime('%H:%M:%S')}")
@@ -364,83 +574,75 @@ def main():
             container_data = generate_fake_container_data(config)
         else:
             try:
-                container_url = f"https://management.azure.com/subscriptions/{config['azure']['subscription_id']}/providers/Microsoft.ContainerInstance/containerGroups?api-version=2021-07-01"
-                container_resp = requests.get(container_url, headers=headers)
+                list_headers = {"If-None-Match": container_etag} if container_etag else {}
+                container_resp = SESSION.get(container_url, headers=list_headers, timeout=10)
                 
-                if container_resp.status_code == 401:
-                    print("Token verlopen, nieuwe token ophalen...")
-                    access_token = get_azure_token(config)
-                    if not access_token:
-                        print("Kon geen nieuwe token ophalen. Script stopt.")
-                        return
-                    headers["Authorization"] = f"Bearer {access_token}"
-                    container_resp = requests.get(container_url, headers=headers)
-                
-                container_resp.raise_for_status()
-                container_data = container_resp.json()
+                if container_resp.status_code == 304 and container_data:
+                    print("Container lijst ongewijzigd (ETag)")
+                else:
+                    container_resp.raise_for_status()
+                    first_page = container_resp.json()
+                    container_data = {"value": list(iter_container_groups(first_page))}
+                    # A 304 only covers the first page, so paged lists are always refetched
+                    container_etag = None if first_page.get("nextLink") else container_resp.headers.get("ETag")
+                    if metric_paths.keys() != {c["id"] for c in container_data["value"]}:
+                        metric_paths = build_metric_paths(container_data["value"])
             except Exception as e:
                 print(f"Fout bij ophalen containers: {e}")
-                time.sleep(10)
+                wait_for_next_tick(tick_start)
                 continue
         
         total_containers = len(container_data.get("value", []))
         
-        send_container_count_to_elasticsearch(config, total_containers)
+        docs = [("metrics-azure.container_count", build_container_count_doc(total_containers, now_iso))]
         
         if total_containers == 0:
+            bulk_future = background.submit(send_bulk_to_elasticsearch, config, docs)
             print("Geen containers gevonden! Er moet minimaal 1 container draaien.")
             send_pushover_notification(
                 config,
+                tracker,
                 "Container Status Alert",
                 "Er zijn geen containers actief! Er moet minimaal 1 container draaien.",
                 priority=2
             )
-            time.sleep(10)
+            bulk_future.result()
+            wait_for_next_tick(tick_start)
             continue
             
         print("\nGevonden container groups:")
         for c in container_data.get("value", []):
             print("-", c["name"])
             
-        end_time = datetime.utcnow()
+        end_time = now
         start_time = end_time - timedelta(minutes=1)
-        timespan = f"{start_time.isoformat()}Z/{end_time.isoformat()}Z"
+        metric_params["timespan"] = f"{start_time.isoformat()}Z/{end_time.isoformat()}Z"
 
         total_rx = 0
         total_tx = 0
         container_metrics = []
 
-        for container in container_data.get("value", []):
-            cid = container["id"]
-            name = container["name"]
+        containers = container_data.get("value", [])
+        if args.debug:
+            results = [(container, generate_fake_metrics()) for container in containers]
+        else:
+            results = fetch_all_container_metrics(containers, metric_paths, metric_params)
 
-            if args.debug:
-                data = generate_fake_metrics()
-            else:
-                metric_url = f"https://management.azure.com{cid}/providers/microsoft.insights/metrics"
-                params = {
-                    "api-version": "2018-01-01",
-                    "metricnames": "NetworkBytesReceivedPerSecond,NetworkBytesTransmittedPerSecond,CpuUsage",
-                    "interval": "PT1M",
-                    "timespan": timespan
-                }
-                r = requests.get(metric_url, headers=headers, params=params)
-                data = r.json()
+        for container, data in results:
+            name = container["name"]
 
             try:
                 rx = data["value"][0]["timeseries"][0]["data"]
                 tx = data["value"][1]["timeseries"][0]["data"]
                 cpu = data["value"][2]["timeseries"][0]["data"]
-                avg_rx = sum(p.get("average", 0) for p in rx) / len(rx)
-                avg_tx = sum(p.get("average", 0) for p in tx) / len(tx)
-                avg_cpu = sum(p.get("average", 0) for p in cpu) / len(cpu)
+                avg_rx, avg_tx, avg_cpu = average_metrics(rx, tx, cpu)
                 
                 network_stats = {
                     "bytes_received": avg_rx,
                     "bytes_transmitted": avg_tx,
                     "cpu_usage": avg_cpu
                 }
-                send_to_elasticsearch(config, container, network_stats)
+                docs.append(("metrics-azure.container_instance", build_container_doc(container, network_stats, now_iso)))
                 
                 total_rx += avg_rx
                 total_tx += avg_tx
@@ -455,6 +657,8 @@ def main():
             except Exception as e:
                 print(f"Geen data voor {name} ({e})")
         
+        bulk_future = background.submit(send_bulk_to_elasticsearch, config, docs)
+        
         if container_metrics:
             avg_rx = total_rx / len(container_metrics)
             avg_tx = total_tx / len(container_metrics)
@@ -466,19 +670,19 @@ def main():
                 print(f"    ALERT: Hoge gemiddelde netwerk activiteit!")
                 print(f"    Gemiddeld ontvangen: {format_bytes(avg_rx)}")
                 print(f"    Gemiddeld verzonden: {format_bytes(avg_tx)}")
-                send_github_workflow_dispatch(config, "average", avg_rx, monitor_only=args.monitor)
+                send_github_workflow_dispatch(config, tracker, "average", avg_rx, monitor_only=args.monitor)
             elif avg_rx < config['thresholds']['network_minimum']:
                 print(f"    ALERT: Lage gemiddelde netwerk activiteit!")
                 print(f"    Gemiddeld ontvangen: {format_bytes(avg_rx)}")
                 print(f"    Gemiddeld verzonden: {format_bytes(avg_tx)}")
                 
                 if len(container_metrics) > 1:  
-                    sorted_containers = sorted(container_data.get("value", []), key=lambda x: x["name"].split("-")[-1])
-                    oldest_container = sorted_containers[0]["name"]
+                    oldest_container = min(container_data["value"], key=lambda x: x["name"].rsplit("-", 1)[-1])["name"]
                     print(f"    Oudste container gevonden: {oldest_container}")
-                    send_github_workflow_dispatch(config, oldest_container, avg_rx, is_destroy=True, total_containers=len(container_metrics), monitor_only=args.monitor)
+                    send_github_workflow_dispatch(config, tracker, oldest_container, avg_rx, is_destroy=True, total_containers=len(container_metrics), monitor_only=args.monitor)
         
-        time.sleep(10)
+        bulk_future.result()
+        wait_for_next_tick(tick_start)
 
 if __name__ == "__main__":
     main() 
@@ -1,13 +1,22 @@
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
 import time
+import sys
+import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from tabulate import tabulate
 import os
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 
 load_dotenv()
 
+if os.name == 'nt':
+    # Run once so the classic Windows console interprets the ANSI escapes used by clear_screen()
+    os.system('')
+
 PROMETHEUS_URL = os.getenv('PROMETHEUS_URL')
 CPU_QUERY = os.getenv('PROMETHEUS_QUERY_CPU', '100 - (avg by (instance) (rate(node_cpu_seconds_total{mode="idle"}[1m])) * 100)')
 RAM_QUERY = os.getenv('PROMETHEUS_QUERY_RAM', '100 * (1 - (node_memory_MemAvailable_bytes / node_memory_MemTotal_bytes))')
@@ -17,39 +26,52 @@ CPU_THRESHOLD = float(os.getenv('CPU_THRESHOLD', '80.0'))
 RAM_THRESHOLD = float(os.getenv('RAM_THRESHOLD', '80.0'))
 CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', '10'))
 ZAMMAD_CUSTOMER = os.getenv('ZAMMAD_CUSTOMER')
+TICKET_CACHE_TTL = int(os.getenv('TICKET_CACHE_TTL', '300'))
+TICKET_WORKERS = 4
 
 PUSHOVER_API_URL = os.getenv('PUSHOVER_API_URL')
 PUSHOVER_USER_KEY = os.getenv('PUSHOVER_USER_KEY')
 PUSHOVER_TOKEN = os.getenv('PUSHOVER_TOKEN')
 
+METRICS_QUERY = (
+    f'label_replace(({CPU_QUERY}), "kind", "cpu", "", "") or '
+    f'label_replace(({RAM_QUERY}), "kind", "ram", "", "")'
+)
+METRICS_BODY = urlencode({"query": METRICS_QUERY}).encode()
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_maxsize=4)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+_open_ticket_cache = {}
+
+INTERACTIVE = sys.stdout.isatty()
+
 parser = argparse.ArgumentParser(description="Prometheus CPU monitor + Zammad ticket creator")
 parser.add_argument("-d", "--debug", action="store_true", help="Debug mode, maakt geen tickets aan")
 args = parser.parse_args()
 
 def log(msg):
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{now}] {msg}")
+    print(f"[{now}] {msg}", file=sys.stdout if INTERACTIVE else sys.stderr)
 
 def get_metrics():
     try:
         log("Haalt metrics op via Prometheus API")
         metrics = {}
         
-        cpu_resp = requests.get(
-            f"{PROMETHEUS_URL}/api/v1/query",
-            params={"query": CPU_QUERY},
-            timeout=5
-        )
-        cpu_resp.raise_for_status()
-        cpu_results = cpu_resp.json()["data"]["result"]
-        
-        ram_resp = requests.get(
+        resp = SESSION.post(
             f"{PROMETHEUS_URL}/api/v1/query",
-            params={"query": RAM_QUERY},
+            data=METRICS_BODY,
+            headers=FORM_HEADERS,
             timeout=5
         )
-        ram_resp.raise_for_status()
-        ram_results = ram_resp.json()["data"]["result"]
+        resp.raise_for_status()
+        results = resp.json()["data"]["result"]
+        cpu_results = [r for r in results if r["metric"].get("kind") == "cpu"]
+        ram_results = [r for r in results if r["metric"].get("kind") == "ram"]
         
         for result in cpu_results:
             instance = result["metric"]["instance"]
@@ -69,7 +91,15 @@ def get_metrics():
         log(f"Fout bij ophalen metrics: {e}")
         return {}
 
+def cache_ticket(instance, resource_type, ticket_id):
+    _open_ticket_cache[(instance, resource_type)] = (ticket_id, time.monotonic() + TICKET_CACHE_TTL)
+
 def ticket_exists(instance, resource_type):
+    cached = _open_ticket_cache.get((instance, resource_type))
+    if cached and time.monotonic() < cached[1]:
+        return True
+    _open_ticket_cache.pop((instance, resource_type), None)
+
     try:
         search_url = f"{ZAMMAD_URL}/api/v1/tickets"
         headers = {
@@ -78,7 +108,7 @@ def ticket_exists(instance, resource_type):
         }
         search_query = f"{instance} {resource_type}"
         params = {"query": search_query}
-        r = requests.get(search_url, headers=headers, params=params)
+        r = SESSION.get(search_url, headers=headers, params=params)
         r.raise_for_status()
         tickets = r.json()
 
@@ -87,6 +117,7 @@ def ticket_exists(instance, resource_type):
                 resource_type in ticket.get("title", "") and 
                 ticket.get("state_id") == 1): 
                 log(f"Ticket bestaat al voor {instance} {resource_type} (ID: {ticket['id']})")
+                cache_ticket(instance, resource_type, ticket["id"])
                 return True
 
         return False
@@ -105,7 +136,7 @@ def send_pushover_notification(instance, resource_type, usage):
             "priority": 1  
         }
         
-        response = requests.post(PUSHOVER_API_URL, json=payload)
+        response = SESSION.post(PUSHOVER_API_URL, json=payload)
         if response.status_code == 200:
             log(f"Pushover notificatie verzonden voor {instance} {resource_type}")
         else:
@@ -140,49 +171,57 @@ def create_ticket(instance, resource_type, usage):
     }
 
     try:
-        r = requests.post(f"{ZAMMAD_URL}/api/v1/tickets", json=payload, headers=headers)
+        r = SESSION.post(f"{ZAMMAD_URL}/api/v1/tickets", json=payload, headers=headers)
         if r.status_code == 201:
             log(f"Ticket succesvol aangemaakt voor {instance} {resource_type}")
+            cache_ticket(instance, resource_type, r.json().get("id"))
         else:
             log(f"Ticketfout {instance}: {r.status_code} - {r.text}")
     except Exception as e:
         log(f"Fout tijdens ticket-aanmaak: {e}")
 
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if INTERACTIVE:
+        sys.stdout.write("\x1b[2J\x1b[H")
+        sys.stdout.flush()
 
 log("Resource monitoring gestart...")
 while True:
+    tick_start = time.monotonic()
     clear_screen()
     metrics = get_metrics()
     
+    alerts = []
     table_data = []
     for instance, values in metrics.items():
-        cpu_status = "!ALERT!" if values["cpu"] > CPU_THRESHOLD else "OK"
-        ram_status = "!ALERT!" if values["ram"] > RAM_THRESHOLD else "OK"
-        table_data.append([
-            instance,
-            f"{values['cpu']:.2f}%",
-            cpu_status,
-            f"{values['ram']:.2f}%",
-            ram_status
-        ])
+        cpu_alert = values["cpu"] > CPU_THRESHOLD
+        ram_alert = values["ram"] > RAM_THRESHOLD
+        if cpu_alert:
+            alerts.append((instance, "CPU", values["cpu"]))
+        if ram_alert:
+            alerts.append((instance, "RAM", values["ram"]))
+        if INTERACTIVE:
+            table_data.append([
+                instance,
+                f"{values['cpu']:.2f}%",
+                "!ALERT!" if cpu_alert else "OK",
+                f"{values['ram']:.2f}%",
+                "!ALERT!" if ram_alert else "OK"
+            ])
     
-    headers = ["Host", "CPU Usage", "CPU Status", "RAM Usage", "RAM Status"]
-    print(tabulate(table_data, headers=headers, tablefmt="grid"))
-    print(f"\nLaatste update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"Check interval: {CHECK_INTERVAL} seconden")
+    if INTERACTIVE:
+        headers = ["Host", "CPU Usage", "CPU Status", "RAM Usage", "RAM Status"]
+        print(tabulate(table_data, headers=headers, tablefmt="grid"))
+        print(f"\nLaatste update: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"Check interval: {CHECK_INTERVAL} seconden")
+    else:
+        print(json.dumps({"timestamp": datetime.now().isoformat(timespec="seconds"), "metrics": metrics}), flush=True)
     
-    for instance, values in metrics.items():
-        if args.debug:
-            if values["cpu"] > CPU_THRESHOLD:
-                log(f"CPU drempel overschreden voor {instance}, maar debugmodus actief")
-            if values["ram"] > RAM_THRESHOLD:
-                log(f"RAM drempel overschreden voor {instance}, maar debugmodus actief")
-        else:
-            if values["cpu"] > CPU_THRESHOLD:
-                create_ticket(instance, "CPU", values["cpu"])
-            if values["ram"] > RAM_THRESHOLD:
-                create_ticket(instance, "RAM", values["ram"])
-
-    time.sleep(CHECK_INTERVAL)
+    if args.debug:
+        for instance, resource_type, usage in alerts:
+            log(f"{resource_type} drempel overschreden voor {instance}, maar debugmodus actief")
+    elif alerts:
+        with ThreadPoolExecutor(max_workers=TICKET_WORKERS) as executor:
+            list(executor.map(lambda alert: create_ticket(*alert), alerts))
+
+    time.sleep(max(0, CHECK_INTERVAL - (time.monotonic() - tick_start)))